@@ -0,0 +1,118 @@
+"""
+Helpers shared by chatter_pipe.py and chatter_daemon.py: device selection,
+inference precision, warmup, sentence chunking and PCM conversion.
+
+Both scripts set OMP_NUM_THREADS/MKL_NUM_THREADS themselves before importing
+this module, since those must be in place before torch is first imported.
+"""
+
+import sys
+import argparse
+import contextlib
+import functools
+import re
+import numpy as np
+import torch
+
+# --- Constants ---
+PRECISION_DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16}
+WARMUP_TEXT = "warmup warmup warmup."
+WARMUP_RUNS = 2
+MAX_CHUNK_CHARS = 300
+CHUNK_GAP_SECONDS = 0.02
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+# --- Argument Parsing ---
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+# --- Device Detection ---
+def pick_device_and_patch(cpu_threads=1, verbose=True):
+    if torch.cuda.is_available():
+        device = "cuda"
+        if verbose:
+            print("Using CUDA device.", file=sys.stderr)
+    elif hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+        device = "mps"
+        if verbose:
+            print("Using MPS device (Mac M1/M2/M3/M4).", file=sys.stderr)
+        # Apply patch for MPS if necessary (from Chatterbox example_for_mac.py)
+        # This helps torch.load map tensors to the MPS device correctly when
+        # loading model weights. A partial keeps the default map_location in C;
+        # an explicit map_location keyword from the caller still wins.
+        torch.load = functools.partial(torch.load, map_location=torch.device(device))
+    else:
+        device = "cpu"
+        if verbose:
+            print("Using CPU device.", file=sys.stderr)
+        torch.set_num_threads(cpu_threads)
+        torch.set_num_interop_threads(cpu_threads)
+    return device
+
+
+# --- Inference Precision ---
+def autocast_context(device, precision):
+    # Mixed precision only pays off on accelerators; CPU always runs in fp32.
+    # Weights stay in fp32 so the conditioning tensors Chatterbox prepares
+    # internally never hit a dtype mismatch; autocast lowers the matmuls.
+    if precision == "fp32" or device not in ("cuda", "mps"):
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device, dtype=PRECISION_DTYPES[precision])
+
+
+# --- Warmup ---
+def warmup_model(model, device, precision, **generate_kwargs):
+    # The first calls pay for lazy CUDA init, cuDNN algorithm search and
+    # torch.compile tracing; run a couple of throwaway generations so the
+    # first real sentence doesn't.
+    if device == "cuda":
+        torch.backends.cudnn.benchmark = True
+    with torch.inference_mode(), autocast_context(device, precision):
+        for _ in range(WARMUP_RUNS):
+            model.generate(WARMUP_TEXT, **generate_kwargs)
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+
+# --- Text Chunking ---
+def split_sentences(text, max_chars=MAX_CHUNK_CHARS):
+    # Pack consecutive sentences greedily into chunks of at most max_chars, so
+    # no single generate() call runs long but neighbouring sentences (and
+    # abbreviations like "Mr.") stay together; text that fits is one chunk.
+    # Only a single sentence longer than max_chars is cut, at word boundaries.
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+        if current and len(current) + 1 + len(sentence) <= max_chars:
+            current += " " + sentence
+            continue
+        if current:
+            chunks.append(current)
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars + 1)
+            if cut <= 0:
+                cut = max_chars
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        current = sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# --- Audio Conversion ---
+def chunk_gap(sample_rate):
+    # Silence put between the chunks of one input line, in every output path,
+    # so chunked sentences don't run together.
+    return np.zeros(int(sample_rate * CHUNK_GAP_SECONDS), dtype=np.int16)
+
+
+def to_pcm16(wav_tensor):
+    # (1, num_samples) float tensor in [-1, 1] -> int16 NumPy array.
+    pcm = (wav_tensor.squeeze(0).clamp(-1, 1) * 32767).to(torch.int16)
+    return pcm.cpu().numpy()
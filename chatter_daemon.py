@@ -32,13 +32,22 @@ Command-Line Arguments:
   -r, --ref-voice       : Path to reference audio file.
   -e, --exaggeration    : Style exaggeration (default: 0.5)
   -t, --temperature     : Temperature (default: 0.5)
+  --precision {fp32,fp16,bf16} : Inference precision on CUDA/MPS.
+                          (Default: fp32; ignored on CPU)
+  --cpu-threads N       : Number of torch threads when running on CPU.
+                          (Default: 1)
+  --cache-size N        : Keep the audio of the last N distinct sentences and
+                          replay it when the same sentence arrives again.
+                          Only bit-exact at temperature 0. (Default: 0, off)
+  --compile, --no-compile : Compile the S3Gen flow estimator with
+                          torch.compile on CUDA/MPS. Adds compile time to
+                          startup. (Default: off)
 
 Key Dependencies:
 - chatterbox.tts (from Resemble AI's Chatterbox) for speech synthesis.
 - torch (PyTorch) as a dependency for Chatterbox.
 - sounddevice for audio playback (if output-mode is 'play').
-- soundfile for saving WAV files (if output-mode is 'file').
-  (Install with: pip install chatterbox-tts torch sounddevice soundfile)
+  (Install with: pip install chatterbox-tts torch sounddevice)
 
 Shutdown:
 - The daemon can be shut down using Ctrl+C (SIGINT) if running in the foreground.
@@ -53,24 +62,118 @@ Shutdown:
 
 import sys
 import os
+
+# Keep OpenMP/MKL from spawning one thread per core; must be set before torch loads.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+
 import time
 import argparse
+import hashlib
+import string
+import struct
+import numpy as np
 import torch
 from chatterbox.tts import ChatterboxTTS
+from chatter_common import (
+    autocast_context,
+    chunk_gap,
+    pick_device_and_patch,
+    positive_int,
+    split_sentences,
+    to_pcm16,
+    warmup_model,
+)
 import queue
 import threading
 import sounddevice as sd
-import soundfile as sf
 import signal
+from collections import OrderedDict, deque
 from typing import Optional
 
 # --- Constants ---
 DEFAULT_PIPE_NAME = "/tmp/chatter_fifo"
+WAV_WRITE_BUFFER_SIZE = 256 * 1024
+PIPE_READ_SIZE = 64 * 1024
+
+# Filename prefixes keep ASCII letters and digits; spaces become underscores.
+_FILENAME_KEEP = (string.ascii_lowercase + string.digits + " ").encode()
+_FILENAME_DELETE = bytes(c for c in range(128) if c not in _FILENAME_KEEP)
+_FILENAME_TABLE = bytes.maketrans(b" ", b"_")
 
 # --- Global Queue for Audio Playback/Saving ---
 # Similar to chatter_pipe.py, for handling audio processing off the main read loop
 audio_task_queue = queue.Queue()
 
+
+# --- Synthesis Cache ---
+class SynthesisCache:
+    # LRU of synthesized audio keyed on everything that shapes the output.
+    # Sampling is only deterministic at temperature 0, so otherwise a hit
+    # replays the first take of a phrase instead of a fresh one.
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(text, voice, exaggeration, temperature):
+        return hashlib.blake2b(
+            f"{text}|{voice}|{exaggeration}|{temperature}".encode(), digest_size=16
+        ).digest()
+
+    def get(self, key) -> Optional[np.ndarray]:
+        audio = self._entries.get(key)
+        if audio is not None:
+            self._entries.move_to_end(key)
+        return audio
+
+    def put(self, key, audio):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = audio
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+# --- Playback Buffer ---
+class PlaybackBuffer:
+    # Feeds queued int16 chunks to a sounddevice OutputStream callback, so the
+    # worker never blocks on playback and the device stays open between
+    # sentences. `drained` is set whenever the callback runs out of audio.
+    def __init__(self):
+        self._chunks = deque()
+        self._current = None
+        self._offset = 0
+        self._lock = threading.Lock()
+        self.drained = threading.Event()
+        self.drained.set()
+
+    def push(self, pcm):
+        with self._lock:
+            self._chunks.append(pcm)
+            self.drained.clear()
+
+    def callback(self, outdata, frames, time_info, status):
+        out = outdata[:, 0]
+        filled = 0
+        while filled < frames:
+            if self._current is None:
+                with self._lock:
+                    if not self._chunks:
+                        self.drained.set()
+                        break
+                    self._current = self._chunks.popleft()
+                self._offset = 0
+            n = min(frames - filled, len(self._current) - self._offset)
+            out[filled : filled + n] = self._current[self._offset : self._offset + n]
+            filled += n
+            self._offset += n
+            if self._offset == len(self._current):
+                self._current = None
+        out[filled:] = 0
+
+
 # --- Global Refs for Signal Handler Cleanup ---
 _pipe_name_ref = None
 _audio_task_queue_ref = None
@@ -105,6 +208,108 @@ def perform_cleanup():
     )  # Changed message slightly to differentiate from signal-specific one
 
 
+# --- Audio Conversion ---
+def wav_header(sample_rate, data_size):
+    # Canonical 44-byte RIFF header for mono 16-bit PCM.
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,  # fmt chunk size
+        1,  # PCM
+        1,  # mono
+        sample_rate,
+        sample_rate * 2,  # byte rate
+        2,  # block align
+        16,  # bits per sample
+        b"data",
+        data_size,
+    )
+
+
+def write_wav(path, pcm, sample_rate):
+    # WAV wants little-endian samples; this is a no-op view on LE hosts.
+    pcm = np.ascontiguousarray(pcm, dtype="<i2")
+    with open(path, "wb", buffering=WAV_WRITE_BUFFER_SIZE) as f:
+        f.write(wav_header(sample_rate, pcm.nbytes))
+        f.write(pcm)
+
+
+def join_with_silence(pcms, sample_rate):
+    # Concatenate chunk audio with the same gap playback inserts between them.
+    if len(pcms) == 1:
+        return pcms[0]
+    gap = chunk_gap(sample_rate)
+    parts = [gap] * (2 * len(pcms) - 1)
+    parts[::2] = pcms
+    return np.concatenate(parts)
+
+
+# --- Synthesis ---
+def synthesize(model, text, device, args, synthesis_cache):
+    # Returns int16 PCM for one chunk of text, from the cache when possible.
+    cache_key = SynthesisCache.make_key(
+        text, args.ref_voice, args.exaggeration, args.temperature
+    )
+    pcm = synthesis_cache.get(cache_key)
+    if pcm is not None:
+        print(f"Using cached audio: '{text}'", file=sys.stderr)
+        return pcm
+
+    print(f"Synthesizing: '{text}'", file=sys.stderr)
+    with torch.inference_mode(), autocast_context(device, args.precision):
+        wav_tensor = model.generate(
+            text,
+            exaggeration=args.exaggeration,
+            temperature=args.temperature,
+        )
+    # generate() wraps the watermarker's NumPy output as-is, whose dtype is not
+    # guaranteed to be float32; normalize it before quantizing. Converting here
+    # means the worker only ever sees int16 PCM and the tensor is freed before
+    # the next generate().
+    pcm = to_pcm16(wav_tensor.float())
+    synthesis_cache.put(cache_key, pcm)
+    return pcm
+
+
+# --- Compilation ---
+def compile_model(model):
+    # The S3Gen flow estimator runs once per ODE step. ConditionalCFM calls
+    # estimator.forward() directly, bypassing __call__, so the bound forward
+    # itself must be replaced; Module.compile() would never be hit. Sequence
+    # lengths change every sentence, hence dynamic shapes. T3's transformer is
+    # left eager: T3.inference() re-patches one of its attention layers and
+    # adds a hook on every call, which would invalidate the compiled guards.
+    estimator = model.s3gen.flow.decoder.estimator
+    estimator.forward = torch.compile(estimator.forward, dynamic=True)
+
+
+# --- Named Pipe Reader ---
+def read_pipe_lines(pipe_name):
+    # Yield the lines sent during one writer session of the FIFO. Reads in
+    # large blocks and decodes only complete lines, instead of a buffered
+    # text readline() per sentence; returns once the last writer closes.
+    fd = os.open(pipe_name, os.O_RDONLY)
+    try:
+        pending = bytearray()
+        while True:
+            chunk = os.read(fd, PIPE_READ_SIZE)
+            if not chunk:
+                break
+            pending += chunk
+            end = pending.rfind(b"\n")
+            if end < 0:
+                continue
+            yield from pending[:end].decode("utf-8", errors="replace").split("\n")
+            del pending[: end + 1]
+        if pending:  # Final line without a trailing newline
+            yield pending.decode("utf-8", errors="replace")
+    finally:
+        os.close(fd)
+
+
 # --- Signal Handler ---
 def signal_handler(signum, frame):
     print(
@@ -123,20 +328,41 @@ def audio_worker(output_mode="play", output_dir="audio_out"):
         os.makedirs(output_dir)
         print(f"Created output directory: {output_dir}", file=sys.stderr)
 
+    playback = PlaybackBuffer()
+    stream = None
+
     while True:
         task = audio_task_queue.get()
         if task is None:  # Sentinel for shutdown
             audio_task_queue.task_done()
             break
 
-        wav_tensor, sample_rate, sentence_text = task
+        pcm, sample_rate, sentence_text, gap_before = task
 
         print(f"Processing audio for: '{sentence_text}'", file=sys.stderr)
 
         if output_mode == "play":
             try:
-                sd.play(wav_tensor.squeeze(0).cpu().numpy(), sample_rate, blocking=True)
-                print(f"Finished playing: '{sentence_text}'", file=sys.stderr)
+                if stream is None:
+                    # Only keep the stream once it is running, so a failed
+                    # start is retried on the next sentence instead of
+                    # silently dropping audio into a dead stream.
+                    new_stream = sd.OutputStream(
+                        samplerate=sample_rate,
+                        channels=1,
+                        dtype="int16",
+                        callback=playback.callback,
+                    )
+                    try:
+                        new_stream.start()
+                    except Exception:
+                        new_stream.close()
+                        raise
+                    stream = new_stream
+                if gap_before:
+                    playback.push(chunk_gap(sample_rate))
+                playback.push(pcm)
+                print(f"Started playback of: '{sentence_text}'", file=sys.stderr)
             except Exception as e:
                 print(f"Error playing audio: {e}", file=sys.stderr)
         elif output_mode == "file":
@@ -144,29 +370,22 @@ def audio_worker(output_mode="play", output_dir="audio_out"):
             try:
                 timestamp = time.strftime("%Y%m%d-%H%M%S")
                 # Create a short, safe prefix from the sentence
+                # ("speech" if it has no usable characters at all)
                 filename_prefix = (
-                    "".join(filter(str.isalnum, sentence_text[:30]))
+                    sentence_text[:30]
                     .lower()
-                    .replace(" ", "_")
+                    .encode("ascii", "ignore")
+                    .translate(_FILENAME_TABLE, _FILENAME_DELETE)
+                    .decode()
+                    .strip("_")
                     or "speech"
                 )
-                if (
-                    not filename_prefix
-                ):  # Handle cases where sentence might be all non-alnum
-                    filename_prefix = "speech"
                 output_filename = os.path.join(
                     output_dir, f"{timestamp}_{filename_prefix}.wav"
                 )
 
-                sf.write(
-                    output_filename, wav_tensor.squeeze(0).cpu().numpy(), sample_rate
-                )
+                write_wav(output_filename, pcm, sample_rate)
                 print(f"Saved audio to: {output_filename}", file=sys.stderr)
-            except NameError:  # If sf (soundfile) was not imported
-                print(
-                    "Error: The 'soundfile' library is required for file output but not installed. Please install it (e.g., pip install soundfile).",
-                    file=sys.stderr,
-                )
             except Exception as e:
                 if output_filename:  # If filename was generated
                     print(
@@ -178,6 +397,12 @@ def audio_worker(output_mode="play", output_dir="audio_out"):
 
         audio_task_queue.task_done()
 
+    if stream is not None:
+        # Let queued sentences finish before releasing the device.
+        playback.drained.wait()
+        stream.stop()
+        stream.close()
+
 
 # --- Main Application Logic ---
 def main():
@@ -224,33 +449,41 @@ def main():
         default=0.5,
         help="Temperature (default: 0.5)",
     )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        choices=["fp32", "fp16", "bf16"],
+        default="fp32",
+        help="Inference precision on CUDA/MPS (default: fp32, ignored on CPU)",
+    )
+    parser.add_argument(
+        "--cpu-threads",
+        type=positive_int,
+        default=1,
+        help="Number of torch threads when running on CPU (default: 1)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=0,
+        help="Number of synthesized sentences to keep and replay for repeated "
+        "input; only bit-exact at temperature 0 (default: 0, disabled)",
+    )
+    parser.add_argument(
+        "--compile",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Compile the S3Gen flow estimator with torch.compile on CUDA/MPS; "
+        "adds compile time to startup (default: off)",
+    )
     parser.add_argument("--debug", action="store_true", help="Enable debug printing.")
     args = parser.parse_args()
 
     global _pipe_name_ref, _audio_task_queue_ref, _audio_thread_ref, _args_debug_ref
     _args_debug_ref = args.debug  # Set global debug ref
 
-    # --- Device Detection (copied from chatter_pipe.py) ---
-    if torch.cuda.is_available():
-        device = "cuda"
-        if args.debug:
-            print("Using CUDA device.", file=sys.stderr)
-    elif hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
-        device = "mps"
-        if args.debug:
-            print("Using MPS device (Mac M1/M2/M3/M4).", file=sys.stderr)
-        torch_load_original = torch.load
-
-        def patched_torch_load(*args_load, **kwargs_load):
-            if "map_location" not in kwargs_load:
-                kwargs_load["map_location"] = torch.device(device)
-            return torch_load_original(*args_load, **kwargs_load)
-
-        torch.load = patched_torch_load
-    else:
-        device = "cpu"
-        if args.debug:
-            print("Using CPU device.", file=sys.stderr)
+    # --- Device Detection ---
+    device = pick_device_and_patch(cpu_threads=args.cpu_threads, verbose=args.debug)
 
     # --- Model Loading (copied from chatter_pipe.py) ---
     if args.debug:
@@ -258,6 +491,30 @@ def main():
     model = ChatterboxTTS.from_pretrained(device=device)
     if args.debug:
         print("Model loaded.", file=sys.stderr)
+    if args.ref_voice:
+        # Embed the reference voice once; passing audio_prompt_path to
+        # generate() would reload and re-encode the file for every sentence.
+        if args.debug:
+            print(f"Preparing reference voice: {args.ref_voice}", file=sys.stderr)
+        with torch.inference_mode():
+            model.prepare_conditionals(args.ref_voice, exaggeration=args.exaggeration)
+    compiled = args.compile and device in ("cuda", "mps")
+    if compiled:
+        if args.debug:
+            print("Compiling flow estimator with torch.compile...", file=sys.stderr)
+        compile_model(model)
+    if device == "cuda" or compiled:
+        if args.debug:
+            print("Warming up model...", file=sys.stderr)
+        warmup_model(
+            model,
+            device,
+            args.precision,
+            exaggeration=args.exaggeration,
+            temperature=args.temperature,
+        )
+
+    synthesis_cache = SynthesisCache(max_entries=args.cache_size)
 
     # --- Start Audio Worker Thread ---
     # The worker needs to know the output mode and directory
@@ -300,44 +557,36 @@ def main():
         while True:
             if args.debug:
                 print(f"Opening pipe {pipe_name} for reading...", file=sys.stderr)
-            with open(pipe_name, "r") as fifo:
-                if args.debug:
-                    print(
-                        f"Pipe {pipe_name} opened. Waiting for input...",
-                        file=sys.stderr,
-                    )
-                while True:  # Keep reading from the currently open pipe
-                    line = fifo.readline()
-                    if not line:  # Pipe closed by writer or empty line if writer closes and reopens
-                        if args.debug:
-                            print(
-                                "Writer closed the pipe or sent empty line. Re-opening.",
-                                file=sys.stderr,
-                            )
-                        break  # Break from inner loop to reopen pipe
-
-                    sentence = line.strip()
-                    if not sentence:
-                        continue
-
-                    if args.debug:
-                        print(f"Received from pipe: '{sentence}'", file=sys.stderr)
-
-                    # --- TTS Inference ---
-                    print(f"Synthesizing: '{sentence}'", file=sys.stderr)
-
-                    wav_tensor = model.generate(
-                        sentence,
-                        audio_prompt_path=args.ref_voice,
-                        exaggeration=args.exaggeration,
-                        temperature=args.temperature,
-                    )
+            # Blocks until a writer opens the pipe; yields until it closes it.
+            for line in read_pipe_lines(pipe_name):
+                sentence = line.strip()
+                if not sentence:
+                    continue
 
-                    # --- Enqueue for Playback/Saving ---
-                    audio_task_queue.put((wav_tensor, model.sr, sentence))
-                    print(
-                        f"Queued for {args.output_mode}: '{sentence}'", file=sys.stderr
+                if args.debug:
+                    print(f"Received from pipe: '{sentence}'", file=sys.stderr)
+
+                # --- TTS Inference & Enqueue for Playback/Saving ---
+                chunks = split_sentences(sentence)
+                if args.output_mode == "play":
+                    # Start playing the first sentence while the rest synthesize
+                    for i, chunk in enumerate(chunks):
+                        pcm = synthesize(model, chunk, device, args, synthesis_cache)
+                        audio_task_queue.put((pcm, model.sr, chunk, i > 0))
+                        print(f"Queued for play: '{chunk}'", file=sys.stderr)
+                else:
+                    # One file per input line, as before
+                    pcm = join_with_silence(
+                        [
+                            synthesize(model, chunk, device, args, synthesis_cache)
+                            for chunk in chunks
+                        ],
+                        model.sr,
                     )
+                    audio_task_queue.put((pcm, model.sr, sentence, False))
+                    print(f"Queued for file: '{sentence}'", file=sys.stderr)
+            if args.debug:
+                print("Writer closed the pipe. Re-opening.", file=sys.stderr)
 
     except Exception as e:  # Catch other exceptions that might occur in the main loop
         print(f"An unexpected error occurred in main loop: {e}", file=sys.stderr)
@@ -1,8 +1,24 @@
 #!/usr/bin/env python3
 
 import sys
+import os
+
+# Keep OpenMP/MKL from spawning one thread per core; must be set before torch loads.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+
+import argparse
 import torch
 from chatterbox.tts import ChatterboxTTS
+from chatter_common import (
+    autocast_context,
+    chunk_gap,
+    pick_device_and_patch,
+    positive_int,
+    split_sentences,
+    to_pcm16,
+    warmup_model,
+)
 import queue
 import threading
 
@@ -18,35 +34,43 @@ except ImportError:
 
 audio_queue = queue.Queue()
 
-def audio_playback_worker():
+PLAYBACK_BLOCK_SIZE = 1024
+
+
+def audio_playback_worker(stream):
+    gap = chunk_gap(int(stream.samplerate))
     while True:
-        wav_tensor, sample_rate, sentence = audio_queue.get()
+        wav_tensor, sentence, gap_before = audio_queue.get()
         print(f"Playing from queue: '{sentence}'", file=sys.stderr)
-        sd.play(wav_tensor.squeeze(0).cpu().numpy(), sample_rate, blocking=True)
+        # Blocks until the samples are buffered; the stream stays open between
+        # sentences, so there is no per-sentence device open/close.
+        if gap_before:  # Later chunk of the same input line
+            stream.write(gap)
+        stream.write(to_pcm16(wav_tensor))
         audio_queue.task_done()
 
+
 def main():
+    parser = argparse.ArgumentParser(
+        description="Speak sentences piped in on stdin using ChatterboxTTS."
+    )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        choices=["fp32", "fp16", "bf16"],
+        default="fp32",
+        help="Inference precision on CUDA/MPS (default: fp32, ignored on CPU)",
+    )
+    parser.add_argument(
+        "--cpu-threads",
+        type=positive_int,
+        default=1,
+        help="Number of torch threads when running on CPU (default: 1)",
+    )
+    args = parser.parse_args()
+
     # Detect device
-    if torch.cuda.is_available():
-        device = "cuda"
-        print("Using CUDA device.", file=sys.stderr)
-    elif hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
-        device = "mps"
-        print("Using MPS device (Mac M1/M2/M3/M4).", file=sys.stderr)
-        # Apply patch for MPS if necessary (from Chatterbox example_for_mac.py)
-        # This helps torch.load map tensors to the MPS device correctly when
-        # loading model weights.
-        torch_load_original = torch.load
-
-        def patched_torch_load(*args, **kwargs):
-            if "map_location" not in kwargs:
-                kwargs["map_location"] = torch.device(device)
-            return torch_load_original(*args, **kwargs)
-
-        torch.load = patched_torch_load
-    else:
-        device = "cpu"
-        print("Using CPU device.", file=sys.stderr)
+    device = pick_device_and_patch(cpu_threads=args.cpu_threads)
 
     print(
         "Loading ChatterboxTTS model... This may take a moment, especially on first run (downloading models).",
@@ -56,6 +80,9 @@ def main():
     # from_pretrained will download models from Hugging Face Hub on the first run.
     # It loads a default voice.
     model = ChatterboxTTS.from_pretrained(device=device)
+    if device == "cuda":
+        print("Warming up model...", file=sys.stderr)
+        warmup_model(model, device, args.precision)
     print("Model loaded. Ready to synthesize speech.", file=sys.stderr)
     print(
         'Pipe sentences to this script (one sentence per line). Example: echo "Hello world" | python this_script.py',
@@ -63,8 +90,19 @@ def main():
     )
     print("Press Ctrl+D (EOF) to exit after all input is processed.", file=sys.stderr)
 
+    # Open the output device once and keep it running for the whole session
+    stream = sd.OutputStream(
+        samplerate=model.sr,
+        channels=1,
+        dtype="int16",
+        blocksize=PLAYBACK_BLOCK_SIZE,
+    )
+    stream.start()
+
     # Start the playback thread
-    playback_thread = threading.Thread(target=audio_playback_worker, daemon=True)
+    playback_thread = threading.Thread(
+        target=audio_playback_worker, args=(stream,), daemon=True
+    )
     playback_thread.start()
 
     try:
@@ -73,21 +111,24 @@ def main():
             if not sentence:
                 continue  # Skip empty lines
 
-            print(f"\nSynthesizing: '{sentence}'", file=sys.stderr)
-            # Generate audio waveform
-            # The model.generate method handles text normalization (e.g., punc_norm)
-            # and uses the default voice and synthesis parameters.
-            # Output is a torch.Tensor of shape (1, num_samples).
-            wav_tensor = model.generate(sentence)
-
-            print("Audio queued for playback.", file=sys.stderr)
-            # Play the audio using sounddevice
-            # sounddevice.play expects a NumPy array.
-            # .squeeze(0) removes the batch dimension.
-            # .cpu().numpy() moves to CPU and converts to NumPy.
-            # Instead of playing directly, put the audio data and sentence into the queue
-            audio_queue.put((wav_tensor, model.sr, sentence))
-            print(f"Added to queue: '{sentence}'", file=sys.stderr)
+            # Long lines are split so playback starts after the first sentence
+            for i, chunk in enumerate(split_sentences(sentence)):
+                print(f"\nSynthesizing: '{chunk}'", file=sys.stderr)
+                # Generate audio waveform
+                # The model.generate method handles text normalization (e.g., punc_norm)
+                # and uses the default voice and synthesis parameters.
+                # Output is a torch.Tensor of shape (1, num_samples).
+                with torch.inference_mode(), autocast_context(device, args.precision):
+                    wav_tensor = model.generate(chunk)
+                # generate() wraps the watermarker's NumPy output as-is, whose
+                # dtype is not guaranteed to be float32; normalize it.
+                wav_tensor = wav_tensor.float()
+
+                print("Audio queued for playback.", file=sys.stderr)
+                # Instead of playing directly, put the audio data and sentence into the queue;
+                # the playback thread converts it to int16 and writes it to the open stream.
+                audio_queue.put((wav_tensor, chunk, i > 0))
+                print(f"Added to queue: '{chunk}'", file=sys.stderr)
 
     except KeyboardInterrupt:
         print("\nExiting due to user interruption (Ctrl+C).", file=sys.stderr)
@@ -97,6 +138,8 @@ def main():
     finally:
         print("Waiting for audio queue to empty...", file=sys.stderr)
         audio_queue.join()  # Wait for all items in the queue to be processed
+        stream.stop()  # Lets the last buffered samples play out
+        stream.close()
         print("Shutting down.", file=sys.stderr)
 
 